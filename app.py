@@ -10,6 +10,7 @@ from utils.ui_components import (
 )
 from utils.pdf_processor import convert_pdf_to_dark_mode, preview_pdf
 from utils.batch_processor import process_batch
+from utils.resource_governor import MemoryBudgetExceeded
 
 def main():
     # Set up the page
@@ -32,7 +33,7 @@ def main():
         
         if uploaded_file is not None:
             # Display file info
-            show_file_details(uploaded_file)
+            show_file_details(uploaded_file, options)
             
             # Process button
             if st.button("Transform PDF"):
@@ -44,11 +45,16 @@ def main():
                 status_text.text("Applying your custom colors...")
                 
                 # Process the PDF
-                result = convert_pdf_to_dark_mode(
-                    uploaded_file,
-                    progress_callback=lambda p: progress_bar.progress(p),
-                    **options
-                )
+                budget_error = None
+                try:
+                    result = convert_pdf_to_dark_mode(
+                        uploaded_file,
+                        progress_callback=lambda p: progress_bar.progress(p),
+                        **options
+                    )
+                except MemoryBudgetExceeded as e:
+                    result = None
+                    budget_error = f"The server is busy. {e} Please try again shortly."
                 
                 if result:
                     # Generate a filename for the output
@@ -72,7 +78,7 @@ def main():
                         if img_data:
                             st.image(img_data, caption="First Page Preview")
                 else:
-                    show_error_message("Transformation failed. Please try another PDF or adjust your settings.")
+                    show_error_message(budget_error or "Transformation failed. Please try another PDF or adjust your settings.")
                 
                 # Reset progress
                 progress_bar.empty()
@@ -101,25 +107,30 @@ def main():
                 
                 # Process the batch
                 status_area.text("Applying your custom colors to all files...")
-                zip_buffer = process_batch(
-                    uploaded_files,
-                    **options
-                )
-                
-                # Success message
-                show_success_message("Batch transformation complete! Your PDFs are ready to download.")
-                
-                # Generate a filename for the zip
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                zip_filename = f"custom_pdfs_{timestamp}.zip"
+                try:
+                    zip_buffer = process_batch(
+                        uploaded_files,
+                        **options
+                    )
+                except MemoryBudgetExceeded as e:
+                    zip_buffer = None
+                    show_error_message(f"The server is busy. {e} Please try again shortly.")
                 
-                # Download button for the zip file
-                st.download_button(
-                    label="Download All Transformed PDFs",
-                    data=zip_buffer,
-                    file_name=zip_filename,
-                    mime="application/zip"
-                )
+                if zip_buffer is not None:
+                    # Success message
+                    show_success_message("Batch transformation complete! Your PDFs are ready to download.")
+                    
+                    # Generate a filename for the zip
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    zip_filename = f"custom_pdfs_{timestamp}.zip"
+                    
+                    # Download button for the zip file
+                    st.download_button(
+                        label="Download All Transformed PDFs",
+                        data=zip_buffer,
+                        file_name=zip_filename,
+                        mime="application/zip"
+                    )
                 
                 # Clear the status area
                 status_area.empty()
@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+import fitz  # PyMuPDF
+import pytest
+
+# Keep pre-scans made by the tests out of the real index; must happen before utils is imported
+os.environ.setdefault("DARCDOCS_INDEX_DIR", tempfile.mkdtemp(prefix="darcdocs-index-"))
+
+
+def build_pdf(pages=3, width=595, height=842, lines=20):
+    """Build an in-memory PDF with a few lines of text and a table line per page."""
+    doc = fitz.open()
+    try:
+        for page_num in range(pages):
+            page = doc.new_page(width=width, height=height)
+            for line in range(lines):
+                page.insert_text((72, 72 + line * 18), f"Page {page_num + 1}, line {line + 1}: lorem ipsum dolor sit amet",
+                                 fontsize=11)
+            page.draw_line(fitz.Point(50, 50), fitz.Point(500, 50))
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+@pytest.fixture
+def pdf_bytes():
+    return build_pdf()
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+
+import fitz  # PyMuPDF
+import pytest
+from PIL import Image
+
+from conftest import build_pdf
+from utils import document_index
+from utils.document_index import (
+    INDEX_VERSION, document_hash, estimate_cost, get_document_index, load_index, save_index, scan_document
+)
+from utils.pdf_processor import convert_pdf_to_dark_mode
+from utils.resource_governor import estimate_job_memory, MB
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_index, "INDEX_DIR", str(tmp_path))
+    return tmp_path
+
+
+def write_entry(index_dir, pdf, entry):
+    with open(os.path.join(index_dir, f"{document_hash(pdf)}.json"), "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+
+
+def build_mixed_pdf():
+    """A text page with a drawing and an image, followed by a blank page."""
+    with Image.new("RGB", (60, 40), "red") as img, io.BytesIO() as png:
+        img.save(png, format="PNG")
+        image = png.getvalue()
+
+    doc = fitz.open()
+    try:
+        page = doc.new_page()
+        page.insert_text((72, 72), "Hello", fontsize=12)
+        page.insert_text((72, 100), "World", fontname="Courier", fontsize=12)
+        page.draw_rect(fitz.Rect(50, 300, 500, 400), color=(0, 0, 0))
+        page.insert_image(fitz.Rect(100, 120, 220, 200), stream=image)
+        doc.new_page(width=300, height=200)
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def describe_output(result):
+    """Text, drawing and image counts of each page of a converted PDF."""
+    doc = fitz.open(stream=result.getvalue(), filetype="pdf")
+    try:
+        return [(page.get_text(), len(page.get_drawings()), len(page.get_images())) for page in doc]
+    finally:
+        doc.close()
+
+
+def convert(pdf):
+    return convert_pdf_to_dark_mode(io.BytesIO(pdf), report_callback=lambda level, message: None)
+
+
+@pytest.mark.parametrize("entry", [
+    {"version": 1, "page_count": 2, "pages": [{}, {}]},
+    {"version": 1, "page_count": 2, "pages": [{"span_count": "many"}, None]},
+    {"version": 1, "page_count": 3, "pages": []},
+    {"version": 1, "page_count": 2},
+    [1, 2, 3],
+])
+def test_malformed_entry_is_ignored(index_dir, entry):
+    pdf = build_pdf(pages=2)
+    write_entry(index_dir, pdf, entry)
+
+    assert load_index(document_hash(pdf)) is None
+    result = convert(pdf)
+    assert result is not None
+    result.close()
+
+
+def test_scan_counts_page_contents():
+    doc = fitz.open(stream=build_mixed_pdf(), filetype="pdf")
+    try:
+        entry = scan_document(doc)
+    finally:
+        doc.close()
+
+    assert entry["version"] == INDEX_VERSION
+    assert entry["page_count"] == 2
+    first, blank = entry["pages"]
+    assert first["span_count"] == 2
+    assert first["has_text"]
+    assert first["drawing_count"] == 1
+    assert len(first["images"]) == 1
+    assert first["images"][0]["area"] == pytest.approx(120 * 80)
+    assert first["fonts"] == ["Courier", "Helvetica"]
+    assert (blank["width"], blank["height"]) == (300, 200)
+    assert blank == dict(blank, span_count=0, has_text=False, drawing_count=0, images=[], fonts=[])
+
+
+def test_index_round_trip_and_version_check(index_dir):
+    pdf = build_pdf(pages=2)
+    doc_hash = document_hash(pdf)
+    assert load_index(doc_hash) is None
+
+    entry = get_document_index(pdf)
+    assert entry["size"] == len(pdf)
+    assert load_index(doc_hash) == entry
+    assert os.listdir(index_dir) == [f"{doc_hash}.json"]
+
+    save_index(doc_hash, dict(entry, version=INDEX_VERSION + 1))
+    assert load_index(doc_hash) is None
+    # A stale entry is rescanned and replaced
+    assert get_document_index(pdf) == entry
+    assert load_index(doc_hash) == entry
+
+
+def test_estimate_cost_summarises_scan(index_dir):
+    pdf = build_mixed_pdf()
+    entry = get_document_index(pdf)
+
+    cost = estimate_cost(entry, use_image_conversion=True, image_quality=1.5, bg_color="#000000")
+    assert cost["pages"] == 2
+    assert cost["text_pages"] == 1
+    assert cost["spans"] == 2
+    assert cost["images"] == 1
+    assert cost["drawings"] == 1
+    assert cost["fonts"] == 2
+    page_sizes = [(595, 842), (300, 200)]
+    assert cost["memory_mb"] == estimate_job_memory(page_sizes, len(pdf), True, 1.5) / MB
+
+
+def test_index_does_not_change_output(index_dir):
+    pdf = build_mixed_pdf()
+
+    result = convert(pdf)
+    without_index = describe_output(result)
+    result.close()
+
+    get_document_index(pdf)
+    result = convert(pdf)
+    with_index = describe_output(result)
+    result.close()
+
+    assert with_index == without_index
+    assert "Hello" in with_index[0][0]
+    assert with_index[0][1] > 0 and with_index[0][2] == 1
+
+
+def test_entry_for_other_page_count_is_not_used(index_dir):
+    pdf = build_mixed_pdf()
+    result = convert(pdf)
+    expected = describe_output(result)
+    result.close()
+
+    # A valid entry that claims one empty page must not suppress anything
+    entry = get_document_index(build_pdf(pages=1, lines=0))
+    entry["pages"][0].update(span_count=0, has_text=False, drawing_count=0, images=[])
+    write_entry(index_dir, pdf, entry)
+    assert load_index(document_hash(pdf))["page_count"] == 1
+
+    result = convert(pdf)
+    assert describe_output(result) == expected
+    result.close()
+
+
+def test_index_is_pruned_to_most_recently_used(index_dir, monkeypatch):
+    monkeypatch.setattr(document_index, "MAX_INDEX_ENTRIES", 2)
+    pdfs = [build_pdf(pages=1, lines=lines) for lines in (1, 2, 3)]
+    hashes = [document_hash(pdf) for pdf in pdfs]
+
+    get_document_index(pdfs[0])
+    get_document_index(pdfs[1])
+    # Make the first entry the oldest, then use it again so the second is pruned instead
+    for i, doc_hash in enumerate(hashes[:2]):
+        os.utime(os.path.join(index_dir, f"{doc_hash}.json"), (1000 + i, 1000 + i))
+    load_index(hashes[0])
+
+    get_document_index(pdfs[2])
+    assert sorted(os.listdir(index_dir)) == sorted(f"{doc_hash}.json" for doc_hash in (hashes[0], hashes[2]))
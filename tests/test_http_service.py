@@ -0,0 +1,270 @@
+import http.client
+import io
+import json
+import socket
+import threading
+import zipfile
+
+import pytest
+
+from conftest import build_pdf
+from utils.http_service import create_server, ConversionHandler, ADMISSION_HEADER
+from utils.resource_governor import governor, AdmissionDecision, MB
+
+
+@pytest.fixture
+def server():
+    server = create_server(port=0, max_concurrency=2, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def conn(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=60)
+    yield conn
+    conn.close()
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def start_upload(server, length, sent=b"%PDF-"):
+    """Open a raw connection that announces a body of the given length but sends only part of it."""
+    sock = socket.create_connection(("127.0.0.1", server.server_port), timeout=10)
+    sock.sendall(f"POST /convert HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode() + sent)
+    return sock
+
+
+def read_until_closed(sock):
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def post(conn, path, body, **kwargs):
+    conn.request("POST", path, body=body, **kwargs)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def get_json(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_convert_streams_pdf(conn, pdf_bytes):
+    response, data = post(conn, "/convert?bg_color=112233&filename=report.pdf", pdf_bytes)
+    assert response.status == 200
+    assert response.getheader("Transfer-Encoding") == "chunked"
+    assert response.getheader("Content-Type") == "application/pdf"
+    assert response.getheader("Content-Disposition").endswith('_report.pdf"')
+    assert data.startswith(b"%PDF-")
+
+
+def test_convert_rejects_bad_options_and_bad_pdfs(conn, pdf_bytes):
+    response, data = post(conn, "/convert?bg_color=zz", pdf_bytes)
+    assert response.status == 400
+    assert "bg_color" in json.loads(data)["error"]
+
+    response, _ = post(conn, "/convert", b"not a pdf")
+    assert response.status == 422
+
+
+def test_filename_cannot_inject_headers(conn, pdf_bytes):
+    response, _ = post(conn, "/convert?filename=a%0d%0aX-Injected:%20yes", pdf_bytes)
+    assert response.status == 200
+    assert response.getheader("X-Injected") is None
+    assert "\r" not in response.getheader("Content-Disposition")
+
+
+def test_chunked_upload(conn, pdf_bytes):
+    def chunks():
+        for i in range(0, len(pdf_bytes), 1000):
+            yield pdf_bytes[i:i + 1000]
+
+    response, data = post(conn, "/convert", chunks(), encode_chunked=True,
+                          headers={"Transfer-Encoding": "chunked"})
+    assert response.status == 200
+    assert data.startswith(b"%PDF-")
+
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_invalid_content_length_returns_400(server, length):
+    with socket.create_connection(("127.0.0.1", server.server_port), timeout=10) as sock:
+        sock.sendall(f"POST /convert HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode())
+        response = read_until_closed(sock)
+        assert response.startswith(b"HTTP/1.1 400")
+        assert b"Invalid Content-Length" in response
+
+    # Unknown paths discard the body and must not fail on it either
+    with socket.create_connection(("127.0.0.1", server.server_port), timeout=10) as sock:
+        sock.sendall(f"POST /nope HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode())
+        response = sock.recv(65536)
+        assert response.startswith(b"HTTP/1.1 404")
+        assert b"Connection: close" in response
+
+
+def test_keep_alive_reuses_connection(conn, pdf_bytes):
+    post(conn, "/convert", pdf_bytes)
+    sock = conn.sock
+    assert sock is not None
+
+    response, _ = post(conn, "/convert", pdf_bytes)
+    assert response.status == 200
+    assert conn.sock is sock
+
+    status, _ = get_json(conn, "/health")
+    assert status == 200
+    assert conn.sock is sock
+
+
+def test_batch_returns_zip_of_pdfs(conn):
+    pdf = build_pdf(pages=2)
+    body = make_zip({"a.pdf": pdf, "nested/b.pdf": pdf, "notes.txt": b"skip me"})
+
+    response, data = post(conn, "/batch", body)
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = archive.namelist()
+        assert len(names) == 3
+        assert names[0].endswith("_a.pdf") and names[1].endswith("_b.pdf")
+        assert names[2] == "manifest.json"
+        assert all(archive.read(name).startswith(b"%PDF-") for name in names[:2])
+
+
+def test_batch_names_are_unique_and_failures_are_listed(conn):
+    pdf = build_pdf(pages=1)
+    body = make_zip({"x/a.pdf": pdf, "y/a.pdf": pdf, "broken.pdf": b"not a pdf"})
+
+    response, data = post(conn, "/batch", body)
+    assert response.status == 200
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        outputs = [entry["output"] for entry in manifest["converted"]]
+        assert [entry["source"] for entry in manifest["converted"]] == ["x/a.pdf", "y/a.pdf"]
+        assert len(set(outputs)) == 2
+        assert manifest["failed"] == ["broken.pdf"]
+        assert sorted(archive.namelist()) == sorted(outputs + ["manifest.json"])
+
+
+def test_batch_rejects_non_zip_and_oversized_members(conn, monkeypatch):
+    response, _ = post(conn, "/batch", b"not a zip")
+    assert response.status == 400
+
+    monkeypatch.setattr("utils.http_service.MAX_MEMBER_BYTES", MB)
+    response, data = post(conn, "/batch", make_zip({"bomb.pdf": b"\0" * (2 * MB)}))
+    assert response.status == 413
+    assert "bomb.pdf" in json.loads(data)["error"]
+
+    monkeypatch.setattr("utils.http_service.MAX_MEMBER_BYTES", 2 * MB)
+    monkeypatch.setattr("utils.http_service.MAX_ARCHIVE_BYTES", 3 * MB)
+    response, _ = post(conn, "/batch", make_zip({"a.pdf": b"\0" * (2 * MB), "b.pdf": b"\0" * (2 * MB)}))
+    assert response.status == 413
+
+
+def test_concurrency_limit_returns_503(server, conn, pdf_bytes):
+    # Take every slot as if other conversions were running
+    for _ in range(2):
+        server.slots.acquire()
+    try:
+        response, _ = post(conn, "/convert", pdf_bytes)
+        assert response.status == 503
+        assert response.getheader("Retry-After")
+    finally:
+        for _ in range(2):
+            server.slots.release()
+
+    # The connection stays usable once a slot is free again
+    response, _ = post(conn, "/convert", pdf_bytes)
+    assert response.status == 200
+
+    _, metrics = get_json(conn, "/metrics")
+    assert metrics["rejected"] == 1
+
+
+def test_stalled_uploads_do_not_hold_slots(server, conn, pdf_bytes):
+    # More stalled uploads than there are slots
+    stalled = [start_upload(server, 1000) for _ in range(3)]
+    try:
+        response, _ = post(conn, "/convert", pdf_bytes)
+        assert response.status == 200
+    finally:
+        for sock in stalled:
+            sock.close()
+
+
+def test_stalled_and_idle_connections_time_out(server, monkeypatch):
+    monkeypatch.setattr(ConversionHandler, "timeout", 0.3)
+
+    sock = start_upload(server, 1000)
+    with sock:
+        response = sock.recv(65536)
+        assert response.startswith(b"HTTP/1.1 408")
+        assert b"Connection: close" in response
+
+    # An idle keep-alive connection is closed rather than kept forever
+    with socket.create_connection(("127.0.0.1", server.server_port), timeout=10) as sock:
+        assert sock.recv(1) == b""
+
+
+def test_budget_timeout_returns_503(conn, pdf_bytes, monkeypatch):
+    monkeypatch.setattr(governor, "budget_bytes", 100 * MB)
+    monkeypatch.setattr(governor, "queue_timeout", 0.1)
+
+    blocker = governor.admit(AdmissionDecision(99 * MB, 2.0, 2.0))
+    blocker.__enter__()
+    try:
+        response, data = post(conn, "/convert?use_image_conversion=true&image_quality=4", pdf_bytes)
+        assert response.status == 503
+        assert response.getheader("Retry-After")
+        assert "memory budget" in json.loads(data)["error"]
+
+        response, _ = post(conn, "/batch?use_image_conversion=true&image_quality=4",
+                           make_zip({"a.pdf": pdf_bytes}))
+        assert response.status == 503
+    finally:
+        blocker.__exit__(None, None, None)
+
+
+def test_admission_reason_is_returned(conn, monkeypatch):
+    monkeypatch.setattr(governor, "budget_bytes", 40 * MB)
+
+    response, data = post(conn, "/convert?use_image_conversion=true&image_quality=4", build_pdf(pages=2))
+    assert response.status == 200
+    assert "Image quality reduced from 4.0" in response.getheader(ADMISSION_HEADER)
+    assert data.startswith(b"%PDF-")
+
+
+def test_metrics_report_throughput_and_latency(conn, pdf_bytes):
+    post(conn, "/convert", pdf_bytes)
+    post(conn, "/convert", b"not a pdf")
+
+    status, metrics = get_json(conn, "/metrics")
+    assert status == 200
+    assert metrics["requests"]["/convert"] == 2
+    assert metrics["requests_total"] == 2
+    assert metrics["in_flight"] == 0
+    assert metrics["bytes_in"] == len(pdf_bytes) + len(b"not a pdf")
+    assert metrics["bytes_out"] > 0
+    assert metrics["throughput_bytes_per_second"] > 0
+    assert 0 < metrics["latency_seconds"]["p50"] <= metrics["latency_seconds"]["max"]
+
+
+def test_unknown_paths_return_404(conn):
+    status, _ = get_json(conn, "/nope")
+    assert status == 404
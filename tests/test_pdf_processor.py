@@ -0,0 +1,96 @@
+import io
+
+import fitz  # PyMuPDF
+import pytest
+from PIL import Image
+
+from conftest import build_pdf
+from utils.pdf_processor import convert_pdf_to_dark_mode, preview_pdf, render_inverted_page
+from utils.soak import open_handles
+
+
+def ignore(level, message):
+    pass
+
+
+@pytest.fixture
+def opened_docs(monkeypatch):
+    """Record every document fitz opens, to check they are all closed again."""
+    docs = []
+    real_open = fitz.open
+
+    def recording_open(*args, **kwargs):
+        doc = real_open(*args, **kwargs)
+        docs.append(doc)
+        return doc
+
+    monkeypatch.setattr(fitz, "open", recording_open)
+    return docs
+
+
+def fail_on_second_page():
+    calls = []
+
+    def progress(fraction):
+        calls.append(fraction)
+        if len(calls) == 2:
+            raise RuntimeError("stop")
+
+    return progress
+
+
+@pytest.mark.parametrize("use_image_conversion", [False, True])
+def test_failed_conversion_closes_documents(opened_docs, use_image_conversion):
+    pdf = build_pdf()
+    opened_docs.clear()
+    handles = open_handles()
+    result = convert_pdf_to_dark_mode(io.BytesIO(pdf), progress_callback=fail_on_second_page(),
+                                      use_image_conversion=use_image_conversion, image_quality=1.0,
+                                      report_callback=ignore)
+    assert result is None
+    # The input and the half-built output
+    assert len(opened_docs) == 2
+    assert all(doc.is_closed for doc in opened_docs)
+    assert open_handles() == handles
+
+
+@pytest.mark.parametrize("data", [b"not a pdf", build_pdf()[:2000]])
+def test_bad_input_leaves_nothing_open(opened_docs, data):
+    handles = open_handles()
+    assert convert_pdf_to_dark_mode(io.BytesIO(data), report_callback=ignore) is None
+    assert preview_pdf(io.BytesIO(data), report_callback=ignore) is None
+    assert all(doc.is_closed for doc in opened_docs)
+    assert open_handles() == handles
+
+
+def test_successful_conversion_closes_documents(opened_docs):
+    result = convert_pdf_to_dark_mode(io.BytesIO(build_pdf()), report_callback=ignore)
+    assert result is not None
+    assert opened_docs and all(doc.is_closed for doc in opened_docs)
+    result.close()
+
+
+def test_render_inverted_page_closes_intermediate_images(monkeypatch):
+    closed = []
+    real_close = Image.Image.close
+
+    def recording_close(self):
+        closed.append(self)
+        real_close(self)
+
+    monkeypatch.setattr(Image.Image, "close", recording_close)
+
+    doc = fitz.open()
+    try:
+        page = doc.new_page(width=100, height=50)
+        data = render_inverted_page(page, 2.0, enhance_contrast=True)
+    finally:
+        doc.close()
+
+    # RGB copy, grayscale, contrast, inverted and RGB result
+    assert len(closed) == 5
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (200, 100)
+        assert img.mode == "RGB"
+        # A blank white page comes out black
+        assert img.getpixel((50, 50)) == (0, 0, 0)
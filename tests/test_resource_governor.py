@@ -0,0 +1,229 @@
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from utils.resource_governor import (
+    AdmissionDecision, MemoryBudgetExceeded, MemoryGovernor, ReservedBuffer, estimate_job_memory,
+    IMAGE_WORKING_BYTES_PER_PIXEL, MIN_IMAGE_QUALITY, MB
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+A4 = (595, 842)
+
+# Converts a generated PDF in a fresh process and reports its peak RSS growth and output size
+MEASURE_SCRIPT = textwrap.dedent("""
+    import io, json, resource, sys
+    sys.path.insert(0, sys.argv[1])
+    from tests.conftest import build_pdf
+    from utils.pdf_processor import convert_pdf_to_dark_mode
+
+    pages, quality = int(sys.argv[2]), float(sys.argv[3])
+    pdf = build_pdf(pages=pages, lines=40)
+    with open("/proc/self/statm") as f:
+        base = int(f.read().split()[1]) * resource.getpagesize()
+    result = convert_pdf_to_dark_mode(io.BytesIO(pdf), use_image_conversion=True, image_quality=quality)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"input": len(pdf), "output": len(result.getvalue()), "peak_growth": peak - base}))
+""")
+
+
+def measure_conversion(pages, quality):
+    env = dict(os.environ, DARCDOCS_MEMORY_BUDGET_MB="100000")
+    out = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT, ROOT, str(pages), str(quality)],
+                         capture_output=True, text=True, env=env, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc to measure RSS")
+def test_image_estimate_matches_measured_conversion():
+    pages, quality = 10, 2.0
+    measured = measure_conversion(pages, quality)
+    estimate = estimate_job_memory([A4] * pages, measured["input"], True, quality)
+
+    # The estimate must cover the real peak without being wildly pessimistic
+    assert estimate >= measured["peak_growth"] * 0.95
+    assert estimate <= measured["peak_growth"] * 1.5
+    # The saved output is counted on top of the output document
+    assert estimate >= 2 * measured["output"]
+
+
+def test_image_estimate_scales_with_quality_squared():
+    low = estimate_job_memory([A4] * 40, 0, True, 1.0)
+    high = estimate_job_memory([A4] * 40, 0, True, 2.0)
+    assert high == pytest.approx(low * 4, rel=0.01)
+
+
+def test_text_estimate_grows_per_page_and_covers_fallback_render():
+    one = estimate_job_memory([A4], 0, False, 2.0)
+    many = estimate_job_memory([A4] * 100, 0, False, 2.0)
+    assert many > one
+
+    # A page that falls back to rendering costs more at higher quality
+    assert estimate_job_memory([A4], 0, False, 4.0) > one
+    assert one >= A4[0] * A4[1] * 2.0 ** 2 * IMAGE_WORKING_BYTES_PER_PIXEL
+
+
+def make_governor(budget_mb, queue_timeout=5.0):
+    return MemoryGovernor(budget_bytes=budget_mb * MB, queue_timeout=queue_timeout)
+
+
+def hold(governor, megabytes):
+    """Reserve part of the budget as if another conversion were running; keep the result alive."""
+    blocker = AdmissionDecision(megabytes * MB, 2.0, 2.0)
+    context = governor.admit(blocker)
+    context.__enter__()
+    return context
+
+
+def test_plan_admits_job_that_fits():
+    governor = make_governor(1024)
+    decision = governor.plan([A4] * 10, 0, True, 2.0)
+    assert decision.image_quality == 2.0
+    assert not decision.queued
+    assert not decision.degraded
+    assert decision.reason == ""
+
+
+def test_plan_degrades_quality_to_fit_free_memory():
+    governor = make_governor(1024)
+    blocker = hold(governor, 900)
+
+    # 40 A4 pages at quality 2.0 need about 490 MB, at 1.0 about 125 MB
+    decision = governor.plan([A4] * 40, 0, True, 2.0)
+    assert decision.degraded
+    assert decision.image_quality == 1.0
+    assert not decision.queued
+    assert decision.estimated_bytes <= 124 * MB
+    assert "reduced from 2.0 to 1.0" in decision.reason
+
+
+def test_plan_queues_when_nothing_fits_now():
+    governor = make_governor(1024)
+    blocker = hold(governor, 1000)
+
+    decision = governor.plan([A4] * 40, 0, True, 2.0)
+    assert decision.queued
+    # Queued jobs keep the best quality that fits the whole budget
+    assert decision.image_quality == 2.0
+    assert "waiting for other conversions" in decision.reason
+
+
+def test_queued_job_is_admitted_when_memory_is_released():
+    governor = make_governor(1024)
+    blocker = hold(governor, 1000)
+    decision = governor.plan([A4] * 40, 0, True, 2.0)
+
+    admitted = threading.Event()
+
+    def run():
+        with governor.admit(decision):
+            admitted.set()
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    assert not admitted.wait(0.2)
+
+    blocker.__exit__(None, None, None)
+    assert admitted.wait(5)
+    worker.join()
+    assert governor.in_use == 0
+    assert governor.active_jobs == 0
+    assert decision.waited_seconds > 0
+
+
+def test_oversize_job_runs_on_its_own():
+    governor = make_governor(100)
+
+    decision = governor.plan([A4] * 40, 0, True, 4.0)
+    assert decision.image_quality == MIN_IMAGE_QUALITY
+    assert decision.estimated_bytes > governor.budget_bytes
+    assert "run on its own" in decision.reason
+
+    # Nothing else is running, so it is admitted straight away and takes the whole budget
+    with governor.admit(decision):
+        assert governor.in_use == governor.budget_bytes
+
+
+def test_oversize_job_waits_for_running_jobs():
+    governor = make_governor(100, queue_timeout=0.2)
+    blocker = hold(governor, 1)
+
+    decision = governor.plan([A4] * 40, 0, True, 4.0)
+    with pytest.raises(MemoryBudgetExceeded):
+        with governor.admit(decision):
+            pass
+
+
+
+def test_waiting_oversize_job_is_not_starved_by_later_jobs():
+    governor = make_governor(100)
+    blocker = hold(governor, 10)
+    order = []
+
+    def run(name, decision):
+        with governor.admit(decision):
+            order.append(name)
+
+    oversize = threading.Thread(target=run, args=("oversize", governor.plan([A4] * 40, 0, True, 4.0)))
+    oversize.start()
+    time.sleep(0.1)
+
+    # A small job that fits the free memory still queues behind the oversize one
+    small = threading.Thread(target=run, args=("small", AdmissionDecision(MB, 2.0, 2.0)))
+    small.start()
+    time.sleep(0.1)
+    assert order == []
+
+    blocker.__exit__(None, None, None)
+    oversize.join(5)
+    small.join(5)
+    assert order == ["oversize", "small"]
+    assert governor.in_use == 0
+
+def test_admit_times_out_when_budget_stays_full():
+    governor = make_governor(1024, queue_timeout=0.1)
+    blocker = hold(governor, 1000)
+
+    decision = governor.plan([A4] * 40, 0, True, 2.0)
+    with pytest.raises(MemoryBudgetExceeded, match="stayed full"):
+        with governor.admit(decision):
+            pass
+    assert governor.active_jobs == 1
+
+
+def test_reserved_buffer_holds_memory_until_closed_or_collected():
+    governor = make_governor(1024)
+
+    result = ReservedBuffer(b"x" * MB)
+    result.reserve(governor, MB)
+    assert governor.in_use == MB
+    result.close()
+    result.close()
+    assert governor.in_use == 0
+
+    result = ReservedBuffer()
+    result.reserve(governor, MB)
+    del result
+    gc.collect()
+    assert governor.in_use == 0
+
+
+def test_conversion_result_keeps_its_reservation(pdf_bytes):
+    from utils.pdf_processor import convert_pdf_to_dark_mode
+    from utils.resource_governor import governor
+
+    before = governor.in_use
+    result = convert_pdf_to_dark_mode(io.BytesIO(pdf_bytes), report_callback=lambda level, message: None)
+    assert governor.active_jobs == 0
+    assert governor.in_use == before + len(result.getvalue())
+    result.close()
+    assert governor.in_use == before
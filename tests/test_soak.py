@@ -0,0 +1,12 @@
+from utils.soak import FAILURE_CASES, generate_corpus, run_failure_case, run_soak
+
+
+def test_failure_cases_fail_cleanly():
+    corpus = generate_corpus()
+    for case in FAILURE_CASES:
+        assert run_failure_case(case, corpus) is None, case
+
+
+def test_short_soak_run_is_clean():
+    # Long enough for every failure case and a batch to run after warm-up
+    assert run_soak(iterations=60, warmup=10, report_every=60) == []
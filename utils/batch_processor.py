@@ -1,21 +1,38 @@
-import streamlit as st
-import io
+import json
+import os
 import zipfile
 from datetime import datetime
-from .pdf_processor import convert_pdf_to_dark_mode
+from .pdf_processor import convert_pdf_to_dark_mode, streamlit_report
+from .resource_governor import governor, ReservedBuffer
 
 def process_batch(uploaded_files, bg_color, text_color, preserve_images, enhance_contrast, 
-                 border_detection, table_detection, use_image_conversion=False, image_quality=2.0):
-    """Process multiple PDF files and return them as a zip file."""
-    # Create a BytesIO object to store the zip file
-    zip_buffer = io.BytesIO()
+                 border_detection, table_detection, use_image_conversion=False, image_quality=2.0,
+                 output=None, report_callback=None, manifest=False):
+    """
+    Process multiple PDF files and return them as a zip file.
+
+    If output is given, the zip is written to that file-like object instead of
+    an in-memory buffer and flushed after every PDF so it can be streamed.
+    Progress and problems are passed to report_callback(level, message).
+    With manifest=True a manifest.json entry is added at the end, mapping each
+    input to its output name and listing the inputs that failed.
+    """
+    report = report_callback or streamlit_report
+    
+    # Create a buffer to store the zip file; it holds the converted PDFs' share
+    # of the memory budget once their own buffers are closed
+    zip_buffer = ReservedBuffer() if output is None else output
     
     # Create a ZipFile object
-    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
+    zip_file = zipfile.ZipFile(zip_buffer, 'w')
+    used_names = set()
+    converted = []
+    failed = []
+    try:
         # Process each PDF file
         for i, uploaded_file in enumerate(uploaded_files):
             # Update the status
-            st.text(f"Processing {i+1}/{len(uploaded_files)}: {uploaded_file.name}")
+            report("status", f"Processing {i+1}/{len(uploaded_files)}: {uploaded_file.name}")
             
             # Convert the PDF to dark mode
             result = convert_pdf_to_dark_mode(
@@ -27,16 +44,47 @@ def process_batch(uploaded_files, bg_color, text_color, preserve_images, enhance
                 border_detection=border_detection,
                 table_detection=table_detection,
                 use_image_conversion=use_image_conversion,
-                image_quality=image_quality
+                image_quality=image_quality,
+                report_callback=report
             )
             
             if result:
-                # Generate a filename for the output
+                # Generate a filename for the output, numbering files that share a name
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                output_filename = f"dark_mode_{timestamp}_{uploaded_file.name}"
+                stem, ext = os.path.splitext(os.path.basename(uploaded_file.name))
+                output_filename = f"dark_mode_{timestamp}_{stem}{ext}"
+                counter = 1
+                while output_filename in used_names:
+                    counter += 1
+                    output_filename = f"dark_mode_{timestamp}_{stem}_{counter}{ext}"
+                used_names.add(output_filename)
+                converted.append({"source": uploaded_file.name, "output": output_filename})
                 
                 # Add the PDF to the zip file
-                zip_file.writestr(output_filename, result.getvalue())
+                pdf_data = result.getvalue()
+                zip_file.writestr(output_filename, pdf_data)
+                if output is None:
+                    zip_buffer.reserve(governor, len(pdf_data))
+                result.close()
+                
+                # Push the finished entry out to a streaming consumer
+                if output is not None and hasattr(output, "flush"):
+                    output.flush()
+            else:
+                failed.append(uploaded_file.name)
+        
+        if manifest:
+            zip_file.writestr("manifest.json", json.dumps({"converted": converted, "failed": failed}, indent=2))
+    except BaseException:
+        # Don't write a zip trailer for a batch that failed part-way: a streaming
+        # consumer then sees a truncated archive, or nothing at all, instead of a
+        # valid-looking partial one. Without a file, close() has nothing to write.
+        zip_file.fp = None
+        raise
+    zip_file.close()
+    
+    if output is not None:
+        return output
     
     # Reset the buffer position to the beginning
     zip_buffer.seek(0)
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import fitz  # PyMuPDF
+from .resource_governor import estimate_job_memory, MB
+
+# Where pre-scan results are kept between runs
+INDEX_DIR = os.environ.get("DARCDOCS_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "darcdocs", "index"))
+
+# Most documents kept in the index; the least recently used are pruned beyond this
+MAX_INDEX_ENTRIES = int(os.environ.get("DARCDOCS_INDEX_MAX_ENTRIES", "1000"))
+
+# Bump when the layout of a page entry changes so stale entries are rescanned
+INDEX_VERSION = 1
+
+# Text extraction flags without image blocks, which we count separately
+SCAN_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+
+def document_hash(pdf_bytes):
+    """Return the key a document is stored under in the index."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def scan_page(page):
+    """Collect the facts about a page that drive the cost of converting it."""
+    text = page.get_text("dict", flags=SCAN_TEXT_FLAGS)
+    span_count = sum(len(line["spans"]) for block in text["blocks"] if block["type"] == 0
+                     for line in block["lines"])
+
+    images = []
+    for img_info in page.get_images(full=True):
+        xref = img_info[0]
+        area = sum(rect.width * rect.height for rect in page.get_image_rects(xref))
+        images.append({"xref": xref, "area": round(area, 2)})
+
+    return {
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "span_count": span_count,
+        "images": images,
+        "drawing_count": len(page.get_cdrawings()),
+        "fonts": sorted({font[3] for font in page.get_fonts()}),
+        "has_text": span_count > 0
+    }
+
+
+def scan_document(doc):
+    """Pre-scan every page of an open fitz document."""
+    return {
+        "version": INDEX_VERSION,
+        "page_count": len(doc),
+        "pages": [scan_page(page) for page in doc]
+    }
+
+
+def _index_path(doc_hash):
+    return os.path.join(INDEX_DIR, f"{doc_hash}.json")
+
+
+# Fields every page entry must have, and the types they must be
+PAGE_FIELDS = {
+    "width": (int, float),
+    "height": (int, float),
+    "span_count": int,
+    "images": list,
+    "drawing_count": int,
+    "fonts": list,
+    "has_text": bool
+}
+
+
+def _is_valid_entry(entry):
+    """Check a stored scan has the layout of the current version, so using it cannot fail."""
+    if not isinstance(entry, dict) or entry.get("version") != INDEX_VERSION:
+        return False
+    pages = entry.get("pages")
+    if not isinstance(pages, list) or entry.get("page_count") != len(pages):
+        return False
+    for page in pages:
+        if not isinstance(page, dict):
+            return False
+        if any(not isinstance(page.get(field), types) for field, types in PAGE_FIELDS.items()):
+            return False
+        if any(not isinstance(image, dict) or not isinstance(image.get("area"), (int, float))
+               for image in page["images"]):
+            return False
+    return True
+
+
+def load_index(doc_hash):
+    """Return the stored scan for a document, or None if it is missing, stale or malformed."""
+    try:
+        with open(_index_path(doc_hash), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not _is_valid_entry(entry):
+        return None
+
+    # Mark the entry as recently used so pruning keeps it
+    try:
+        os.utime(_index_path(doc_hash))
+    except OSError:
+        pass
+    return entry
+
+
+def save_index(doc_hash, entry):
+    """Persist a scan atomically so concurrent readers never see a partial file."""
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INDEX_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _index_path(doc_hash))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return
+    _prune_index()
+
+
+def _prune_index():
+    """Delete the least recently used entries once the index holds more than MAX_INDEX_ENTRIES."""
+    try:
+        names = [name for name in os.listdir(INDEX_DIR) if name.endswith(".json")]
+        if len(names) <= MAX_INDEX_ENTRIES:
+            return
+        entries = []
+        for name in names:
+            path = os.path.join(INDEX_DIR, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                # Already removed by another process
+                continue
+    except OSError:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - MAX_INDEX_ENTRIES]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def get_document_index(pdf_bytes):
+    """Load the scan for a document from the index, scanning and storing it if needed."""
+    doc_hash = document_hash(pdf_bytes)
+    entry = load_index(doc_hash)
+    if entry is None:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            entry = scan_document(doc)
+        finally:
+            doc.close()
+        entry["size"] = len(pdf_bytes)
+        save_index(doc_hash, entry)
+    return entry
+
+
+def estimate_cost(entry, use_image_conversion=False, image_quality=2.0, **options):
+    """Summarise how expensive a scanned document is to convert with the given options."""
+    pages = entry["pages"]
+    page_sizes = [(page["width"], page["height"]) for page in pages]
+    memory = estimate_job_memory(page_sizes, entry.get("size", 0), use_image_conversion, image_quality)
+
+    return {
+        "pages": len(pages),
+        "text_pages": sum(1 for page in pages if page["has_text"]),
+        "spans": sum(page["span_count"] for page in pages),
+        "images": sum(len(page["images"]) for page in pages),
+        "drawings": sum(page["drawing_count"] for page in pages),
+        "fonts": len({font for page in pages for font in page["fonts"]}),
+        "memory_mb": memory / MB
+    }
@@ -0,0 +1,500 @@
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .pdf_processor import convert_pdf_to_dark_mode
+from .batch_processor import process_batch
+from .document_index import get_document_index, estimate_cost
+from .resource_governor import MemoryBudgetExceeded
+
+# Conversions allowed to run at the same time; further requests get 503
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("DARCDOCS_MAX_CONCURRENCY", "2"))
+
+# Largest request body we accept, in bytes
+MAX_BODY_BYTES = int(os.environ.get("DARCDOCS_MAX_BODY_MB", "200")) * 1024 * 1024
+
+# Limits on the uncompressed contents of a batch zip, checked before anything is extracted
+MAX_MEMBER_BYTES = int(os.environ.get("DARCDOCS_MAX_MEMBER_MB", "200")) * 1024 * 1024
+MAX_ARCHIVE_BYTES = int(os.environ.get("DARCDOCS_MAX_ARCHIVE_MB", "500")) * 1024 * 1024
+
+# Request bodies larger than this are spooled to disk instead of memory
+SPOOL_BYTES = 8 * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# Seconds a connection may sit idle or stall mid-request before it is dropped
+REQUEST_TIMEOUT = float(os.environ.get("DARCDOCS_REQUEST_TIMEOUT", "60"))
+
+# Seconds clients are asked to wait before retrying a request we could not take
+RETRY_AFTER = "5"
+
+# Response header carrying why the memory governor degraded or queued the job
+ADMISSION_HEADER = "X-DarcDocs-Admission"
+
+# Defaults mirror the sidebar in ui_components.create_sidebar
+DEFAULT_OPTIONS = {
+    "bg_color": "#000000",
+    "text_color": "#FFFFFF",
+    "preserve_images": True,
+    "enhance_contrast": False,
+    "border_detection": True,
+    "table_detection": True,
+    "use_image_conversion": False,
+    "image_quality": 2.0
+}
+
+
+class RequestError(Exception):
+    """An error that maps directly onto an HTTP status code."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def parse_options(query):
+    """Build conversion options from query string parameters."""
+    params = parse_qs(query)
+    options = dict(DEFAULT_OPTIONS)
+
+    for key, default in DEFAULT_OPTIONS.items():
+        if key not in params:
+            continue
+        value = params[key][-1]
+        if isinstance(default, bool):
+            options[key] = value.lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, float):
+            try:
+                options[key] = min(4.0, max(1.0, float(value)))
+            except ValueError:
+                raise RequestError(400, f"Invalid value for {key}: {value}")
+        else:
+            if not value.startswith("#"):
+                value = "#" + value
+            if len(value) != 7 or any(c not in "0123456789abcdefABCDEF" for c in value[1:]):
+                raise RequestError(400, f"Invalid color for {key}: {value}")
+            options[key] = value
+
+    return options
+
+
+def safe_filename(name, default="document.pdf"):
+    """Reduce a client-supplied file name to characters that are safe in a header."""
+    name = re.sub(r"[^A-Za-z0-9._ -]", "_", os.path.basename(name)).strip(" .")
+    return name or default
+
+
+class Metrics:
+    """Thread-safe throughput and latency counters for the /metrics endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = []
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record(self, endpoint, status, seconds, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if status >= 500:
+                self.errors += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.latencies.append(seconds)
+            # Keep a bounded window for the percentiles
+            if len(self.latencies) > 1000:
+                del self.latencies[:-1000]
+
+    def snapshot(self):
+        with self._lock:
+            uptime = time.time() - self.started
+            latencies = sorted(self.latencies)
+            total = sum(self.requests.values())
+
+            def percentile(p):
+                if not latencies:
+                    return 0.0
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+            return {
+                "uptime_seconds": round(uptime, 3),
+                "requests": dict(self.requests),
+                "requests_total": total,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "throughput_bytes_per_second": round(self.bytes_out / uptime, 3) if uptime else 0.0,
+                "latency_seconds": {
+                    "p50": round(percentile(0.5), 4),
+                    "p90": round(percentile(0.9), 4),
+                    "p99": round(percentile(0.99), 4),
+                    "max": round(latencies[-1], 4) if latencies else 0.0
+                }
+            }
+
+
+class ChunkedWriter:
+    """File-like object that writes HTTP/1.1 chunked transfer encoding.
+
+    Nothing is sent until the first flush() or close(): the response headers go
+    out through on_start at that point, so a failure before then (including the
+    zip trailer ZipFile writes while unwinding) can still get a proper status.
+    """
+
+    def __init__(self, wfile, on_start=None):
+        self.wfile = wfile
+        self.on_start = on_start
+        self.started = False
+        self.pending = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        if data:
+            if self.started:
+                self._send(data)
+            else:
+                self.pending.append(bytes(data))
+        return len(data)
+
+    def _send(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii"))
+        self.wfile.write(data)
+        self.wfile.write(b"\r\n")
+        self.bytes_written += len(data)
+
+    def flush(self):
+        if not self.started:
+            self.started = True
+            if self.on_start:
+                self.on_start()
+            pending, self.pending = self.pending, []
+            for data in pending:
+                self._send(data)
+        self.wfile.flush()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class NamedUpload:
+    """Minimal stand-in for a Streamlit UploadedFile backed by a zip member."""
+
+    def __init__(self, archive, info):
+        self.archive = archive
+        # Keep the path inside the archive, so a.pdf and docs/a.pdf stay distinguishable
+        self.name = info.filename
+        self.size = info.file_size
+        self._info = info
+
+    def read(self):
+        return self.archive.read(self._info)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """Serve /convert, /batch, /scan, /metrics and /health."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "DarcDocs"
+    # Applies to every socket read and write; an idle keep-alive connection is simply closed
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.server.metrics.snapshot())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path not in ("/convert", "/batch", "/scan"):
+            self._discard_body()
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        start = time.monotonic()
+        status = 500
+        bytes_in = 0
+        self._stream = None
+        self._admission = []
+
+        # Spool the whole body before taking a slot, so a slow upload ties up a
+        # connection but never one of the conversion slots
+        try:
+            body = self._read_body()
+        except RequestError as e:
+            self.server.metrics.record(url.path, e.status, time.monotonic() - start)
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+            return
+
+        with body:
+            if not self.server.slots.acquire(blocking=False):
+                self.server.metrics.reject()
+                self._send_json(503, {"error": "Too many conversions in progress"}, {"Retry-After": RETRY_AFTER})
+                return
+
+            self.server.metrics.begin()
+            try:
+                options = parse_options(url.query)
+                bytes_in = body.tell()
+                body.seek(0)
+                if url.path == "/convert":
+                    self._convert(body, options, parse_qs(url.query))
+                elif url.path == "/scan":
+                    self._scan(body, options)
+                else:
+                    self._batch(body, options)
+                status = 200
+            except MemoryBudgetExceeded as e:
+                status = 503
+                if self._stream is None or not self._stream.started:
+                    self._send_json(status, {"error": str(e)}, {"Retry-After": RETRY_AFTER})
+                else:
+                    self.close_connection = True
+            except RequestError as e:
+                status = e.status
+                self._send_json(status, {"error": str(e)}, e.headers)
+            except Exception as e:
+                if self._stream is None or not self._stream.started:
+                    self._send_json(500, {"error": f"Error processing PDF: {str(e)}"})
+                else:
+                    # Headers are gone; the only thing left is to drop the connection
+                    self.close_connection = True
+            finally:
+                self.server.slots.release()
+                self.server.metrics.end()
+                self.server.metrics.record(url.path, status, time.monotonic() - start, bytes_in,
+                                           self._stream.bytes_written if self._stream else 0)
+
+    def _report(self, level, message):
+        # Admission decisions go back to the client; everything else goes to the log
+        if level == "info":
+            self._admission.append(message)
+        elif level != "status":
+            self.log_message("%s: %s", level, message)
+
+    def _convert(self, body, options, params):
+        # The output PDF is built in memory in full before the first chunk is sent;
+        # only /batch streams, one finished PDF at a time
+        result = convert_pdf_to_dark_mode(body, report_callback=self._report, **options)
+        if result is None:
+            raise RequestError(422, "Transformation failed. Please try another PDF or adjust your settings.")
+
+        # Closing the result hands its memory back to the governor
+        with result:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            name = safe_filename(params.get("filename", ["document.pdf"])[-1])
+            writer = self._start_stream("application/pdf", f"custom_{timestamp}_{name}")
+            while True:
+                chunk = result.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                writer.flush()
+            writer.close()
+
+    def _scan(self, body, options):
+        try:
+            entry = get_document_index(body.read())
+        except Exception:
+            raise RequestError(422, "Could not scan this PDF")
+        self._send_json(200, {"cost": estimate_cost(entry, **options), "index": entry})
+
+    def _batch(self, body, options):
+        try:
+            archive = zipfile.ZipFile(body)
+        except zipfile.BadZipFile:
+            raise RequestError(400, "Batch requests must be a zip archive of PDFs")
+
+        with archive:
+            uploads = [NamedUpload(archive, info) for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(".pdf")]
+            if not uploads:
+                raise RequestError(400, "The zip archive does not contain any PDFs")
+
+            # Sizes come from the zip headers, and extraction never reads past them
+            for upload in uploads:
+                if upload.size > MAX_MEMBER_BYTES:
+                    raise RequestError(413, f"{upload.name} is too large when uncompressed")
+            if sum(upload.size for upload in uploads) > MAX_ARCHIVE_BYTES:
+                raise RequestError(413, "The zip archive is too large when uncompressed")
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            writer = self._start_stream("application/zip", f"custom_pdfs_{timestamp}.zip")
+            # Each PDF is flushed to the client as soon as it has been converted
+            process_batch(uploads, output=writer, report_callback=self._report, manifest=True, **options)
+            writer.close()
+
+    def _read_body(self):
+        """Stream the request body into a spooled temporary file."""
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        try:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                while True:
+                    line = self.rfile.readline(65537)
+                    try:
+                        size = int(line.split(b";")[0].strip(), 16)
+                    except ValueError:
+                        raise RequestError(400, "Malformed chunked body")
+                    if size == 0:
+                        # Skip any trailers
+                        while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):
+                            pass
+                        break
+                    self._copy(body, size)
+                    self.rfile.readline(65537)
+            else:
+                length = self._content_length()
+                if length is None:
+                    raise RequestError(411, "Content-Length or chunked Transfer-Encoding required")
+                self._copy(body, length)
+        except TimeoutError:
+            body.close()
+            self.close_connection = True
+            raise RequestError(408, "Timed out waiting for the request body")
+        except Exception:
+            body.close()
+            self.close_connection = True
+            raise
+        return body
+
+    def _copy(self, body, size):
+        if body.tell() + size > MAX_BODY_BYTES:
+            raise RequestError(413, "Request body too large")
+        while size > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, size))
+            if not chunk:
+                raise RequestError(400, "Request body ended early")
+            body.write(chunk)
+            size -= len(chunk)
+
+    def _content_length(self):
+        """The request's Content-Length, or None if it has none."""
+        length = self.headers.get("Content-Length")
+        if length is None:
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise RequestError(400, "Invalid Content-Length")
+        return length
+
+    def _discard_body(self):
+        try:
+            length = self._content_length() or 0
+        except RequestError:
+            # Nothing tells us where the body ends, so the connection can't be reused
+            self.close_connection = True
+            return
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked" or length > MAX_BODY_BYTES:
+            # Not worth reading; make the client reconnect instead
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def _start_stream(self, content_type, filename):
+        def send_headers():
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Disposition", f'attachment; filename="{safe_filename(filename)}"')
+            self.send_header("Transfer-Encoding", "chunked")
+            if self._admission:
+                # Our own messages, but keep them on one header line regardless
+                reason = " | ".join(self._admission).replace("\r", " ").replace("\n", " ")
+                self.send_header(ADMISSION_HEADER, reason)
+            self.end_headers()
+
+        self._stream = ChunkedWriter(self.wfile, on_start=send_headers)
+        return self._stream
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the shared concurrency limit and metrics."""
+
+    daemon_threads = True
+
+    def __init__(self, address, max_concurrency=DEFAULT_MAX_CONCURRENCY, quiet=False):
+        super().__init__(address, ConversionHandler)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.metrics = Metrics()
+        self.quiet = quiet
+
+
+def create_server(host="127.0.0.1", port=8000, max_concurrency=DEFAULT_MAX_CONCURRENCY, quiet=False):
+    """Create the conversion server; pass port 0 to bind a free port."""
+    return ConversionServer((host, port), max_concurrency=max_concurrency, quiet=quiet)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DarcDocs HTTP conversion service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.max_concurrency)
+    print(f"DarcDocs service listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,29 @@
 import streamlit as st
 import fitz  # PyMuPDF
 import io
-from PIL import Image, ImageOps
-import os
-import tempfile
+import logging
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from PIL import Image, ImageOps, ImageEnhance
+from .resource_governor import governor, MemoryBudgetExceeded, ReservedBuffer
+from .document_index import document_hash, load_index
+
+logger = logging.getLogger(__name__)
+
+# How each report level is shown in Streamlit, and logged everywhere else
+REPORT_LEVELS = {
+    "status": (st.text, logging.DEBUG),
+    "info": (st.info, logging.INFO),
+    "warning": (st.warning, logging.WARNING),
+    "error": (st.error, logging.ERROR)
+}
+
+def streamlit_report(level, message):
+    """Show a message in the Streamlit UI, or log it when not running inside a Streamlit script."""
+    show, log_level = REPORT_LEVELS[level]
+    if get_script_run_ctx(suppress_warning=True) is None:
+        logger.log(log_level, message)
+    else:
+        show(message)
 
 def is_likely_border(contour, page_width, page_height, threshold=0.8):
     """Determine if a contour is likely a border based on its size relative to the page."""
@@ -24,218 +44,237 @@ def is_likely_border(contour, page_width, page_height, threshold=0.8):
     
     return is_horizontal_border or is_vertical_border or is_page_border
 
+def render_inverted_page(page, image_quality, enhance_contrast=False):
+    """Render a page as PNG bytes with inverted grayscale colors, closing every intermediate image."""
+    # Render the page as an image and copy it into PIL; the pixmap is freed as soon as it is copied
+    pix = page.get_pixmap(alpha=False, matrix=fitz.Matrix(image_quality, image_quality))
+    images = [Image.frombytes("RGB", [pix.width, pix.height], pix.samples)]
+    del pix
+    
+    try:
+        # Convert to grayscale, invert colors, and convert back to RGB
+        images.append(ImageOps.grayscale(images[-1]))
+        
+        # Enhance contrast if requested
+        if enhance_contrast:
+            enhancer = ImageEnhance.Contrast(images[-1])
+            images.append(enhancer.enhance(1.5))  # Increase contrast by 50%
+        
+        images.append(ImageOps.invert(images[-1]))
+        images.append(images[-1].convert("RGB"))
+        
+        # Convert PIL Image to bytes
+        with io.BytesIO() as img_bytes:
+            images[-1].save(img_bytes, format="PNG", quality=95)  # Use high quality for PNG
+            return img_bytes.getvalue()
+    finally:
+        for img in images:
+            img.close()
+
 def convert_pdf_to_dark_mode(input_file, progress_callback=None, bg_color="#000000", text_color="#FFFFFF", 
                             preserve_images=True, enhance_contrast=False, border_detection=True, table_detection=True,
-                            use_image_conversion=False, image_quality=2.0):
+                            use_image_conversion=False, image_quality=2.0, report_callback=None):
     """
     Convert a PDF to dark mode:
     - Black background (or custom color)
     - White text (or custom color)
     - Preserved images
     - White borders
+    
+    Messages are passed to report_callback(level, message), which defaults to
+    showing them in Streamlit. Raises MemoryBudgetExceeded if the job could not
+    be admitted against the memory budget in time.
     """
+    report = report_callback or streamlit_report
+    doc = None
+    out_doc = None
     try:
         # Open the PDF
-        doc = fitz.open(stream=input_file.read(), filetype="pdf")
+        pdf_bytes = input_file.read()
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         total_pages = len(doc)
         
-        # Create a new PDF for the output
-        out_doc = fitz.open()
+        # Facts from an earlier pre-scan let us skip stages that have nothing to do
+        index = load_index(document_hash(pdf_bytes))
+        page_facts = index["pages"] if index and index["page_count"] == total_pages else None
         
-        # Convert hex color to RGB tuple (0-1 range)
-        bg_rgb = tuple(int(bg_color.lstrip('#')[i:i+2], 16)/255 for i in (0, 2, 4))
-        text_rgb = tuple(int(text_color.lstrip('#')[i:i+2], 16)/255 for i in (0, 2, 4))
+        # Check the job against the memory budget before allocating anything large
+        page_sizes = [(page.rect.width, page.rect.height) for page in doc]
+        decision = governor.plan(page_sizes, len(pdf_bytes), use_image_conversion, image_quality)
+        if decision.reason:
+            report("info", decision.reason)
+        image_quality = decision.image_quality
         
-        for page_num, page in enumerate(doc):
-            # Update progress
-            if progress_callback:
-                progress_callback((page_num + 1) / total_pages)
+        with governor.admit(decision):
+            # Create a new PDF for the output
+            out_doc = fitz.open()
             
-            # Create a new page in the output document
-            out_page = out_doc.new_page(width=page.rect.width, height=page.rect.height)
+            # Convert hex color to RGB tuple (0-1 range)
+            bg_rgb = tuple(int(bg_color.lstrip('#')[i:i+2], 16)/255 for i in (0, 2, 4))
+            text_rgb = tuple(int(text_color.lstrip('#')[i:i+2], 16)/255 for i in (0, 2, 4))
             
-            # Get the page dimensions
-            page_width = page.rect.width
-            page_height = page.rect.height
-            
-            # First, fill the entire page with the background color
-            out_page.draw_rect(fitz.Rect(0, 0, page_width, page_height), color=bg_rgb, fill=bg_rgb)
-            
-            # If image-based conversion is selected, use that approach
-            if use_image_conversion:
-                # Render the page as an image with higher quality
-                pix = page.get_pixmap(alpha=False, matrix=fitz.Matrix(image_quality, image_quality))
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            for page_num, page in enumerate(doc):
+                # Update progress
+                if progress_callback:
+                    progress_callback((page_num + 1) / total_pages)
                 
-                # Convert to grayscale, invert colors, and convert back to RGB
-                img_gray = ImageOps.grayscale(img)
+                facts = page_facts[page_num] if page_facts else None
                 
-                # Enhance contrast if requested
-                if enhance_contrast:
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Contrast(img_gray)
-                    img_gray = enhancer.enhance(1.5)  # Increase contrast by 50%
+                # Create a new page in the output document
+                out_page = out_doc.new_page(width=page.rect.width, height=page.rect.height)
                 
-                img_inverted = ImageOps.invert(img_gray)
-                img_rgb = img_inverted.convert("RGB")
+                # Get the page dimensions
+                page_width = page.rect.width
+                page_height = page.rect.height
                 
-                # Convert PIL Image to bytes
-                img_bytes = io.BytesIO()
-                img_rgb.save(img_bytes, format="PNG", quality=95)  # Use high quality for PNG
-                img_bytes.seek(0)
+                # First, fill the entire page with the background color
+                out_page.draw_rect(fitz.Rect(0, 0, page_width, page_height), color=bg_rgb, fill=bg_rgb)
                 
-                # Insert the inverted image
-                out_page.insert_image(fitz.Rect(0, 0, page_width, page_height), stream=img_bytes.getvalue())
-            else:
-                # Use the original text-based approach
-                try:
-                    # Process text: extract and redraw with custom color
-                    text_blocks = page.get_text("dict")["blocks"]
-                    for block in text_blocks:
-                        if block["type"] == 0:  # Text block
-                            for line in block["lines"]:
-                                for span in line["spans"]:
-                                    text = span["text"]
-                                    bbox = fitz.Rect(span["bbox"])
-                                    try:
-                                        # Try to use the original font
-                                        out_page.insert_text(
-                                            bbox.tl,  # top-left point
-                                            text,
-                                            fontname=span["font"],
-                                            fontsize=span["size"],
-                                            color=text_rgb  # Use custom text color
-                                        )
-                                    except RuntimeError as font_error:
-                                        # If original font fails, use a fallback font
-                                        if "FT_New_Memory_Face" in str(font_error):
+                # If image-based conversion is selected, use that approach
+                if use_image_conversion:
+                    # Render the page as an inverted image with higher quality
+                    img_bytes = render_inverted_page(page, image_quality, enhance_contrast)
+                    
+                    # Insert the inverted image
+                    out_page.insert_image(fitz.Rect(0, 0, page_width, page_height), stream=img_bytes)
+                elif facts is None or facts["span_count"] > 0:
+                    # Use the original text-based approach
+                    try:
+                        # Process text: extract and redraw with custom color
+                        text_blocks = page.get_text("dict")["blocks"]
+                        for block in text_blocks:
+                            if block["type"] == 0:  # Text block
+                                for line in block["lines"]:
+                                    for span in line["spans"]:
+                                        text = span["text"]
+                                        bbox = fitz.Rect(span["bbox"])
+                                        try:
+                                            # Try to use the original font
                                             out_page.insert_text(
-                                                bbox.tl,
+                                                bbox.tl,  # top-left point
                                                 text,
-                                                fontname="helv",  # Use Helvetica as fallback
+                                                fontname=span["font"],
                                                 fontsize=span["size"],
                                                 color=text_rgb  # Use custom text color
                                             )
-                                        else:
-                                            # Re-raise if it's not a font error
-                                            raise
-                except Exception as text_error:
-                    # If text extraction fails, try to render the page as an image
-                    st.warning(f"Text extraction failed on page {page_num+1}, using image-based conversion.")
-                    pix = page.get_pixmap(alpha=False, matrix=fitz.Matrix(image_quality, image_quality))
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                    
-                    # Convert to grayscale, invert colors, and convert back to RGB
-                    img_gray = ImageOps.grayscale(img)
-                    img_inverted = ImageOps.invert(img_gray)
-                    img_rgb = img_inverted.convert("RGB")
-                    
-                    # Convert PIL Image to bytes
-                    img_bytes = io.BytesIO()
-                    img_rgb.save(img_bytes, format="PNG", quality=95)
-                    img_bytes.seek(0)
-                    
-                    # Insert the inverted image
-                    out_page.insert_image(fitz.Rect(0, 0, page_width, page_height), stream=img_bytes.getvalue())
-            
-            # Only process images if preserve_images is True and we're not using image-based conversion
-            if preserve_images and not use_image_conversion:
-                try:
-                    # Process images: extract and redraw as is
-                    image_list = page.get_images(full=True)
-                    for img_index, img_info in enumerate(image_list):
-                        xref = img_info[0]
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
+                                        except RuntimeError as font_error:
+                                            # If original font fails, use a fallback font
+                                            if "FT_New_Memory_Face" in str(font_error):
+                                                out_page.insert_text(
+                                                    bbox.tl,
+                                                    text,
+                                                    fontname="helv",  # Use Helvetica as fallback
+                                                    fontsize=span["size"],
+                                                    color=text_rgb  # Use custom text color
+                                                )
+                                            else:
+                                                # Re-raise if it's not a font error
+                                                raise
+                    except Exception as text_error:
+                        # If text extraction fails, try to render the page as an image
+                        report("warning", f"Text extraction failed on page {page_num+1}, using image-based conversion.")
+                        img_bytes = render_inverted_page(page, image_quality)
                         
-                        # Convert image bytes to PIL Image
-                        img = Image.open(io.BytesIO(image_bytes))
-                        
-                        # Get image position on the page
-                        img_rect = page.get_image_bbox(img_info)
-                        
-                        # Insert the image back into the new page
-                        out_page.insert_image(img_rect, stream=image_bytes)
-                except Exception as img_error:
-                    # If image extraction fails, continue with the rest of the process
-                    st.warning(f"Image extraction failed on page {page_num+1}. Some images may not be preserved.")
+                        # Insert the inverted image
+                        out_page.insert_image(fitz.Rect(0, 0, page_width, page_height), stream=img_bytes)
+                
+                # Only process images if preserve_images is True and we're not using image-based conversion
+                if preserve_images and not use_image_conversion and (facts is None or facts["images"]):
+                    try:
+                        # Process images: extract and redraw as is
+                        image_list = page.get_images(full=True)
+                        for img_index, img_info in enumerate(image_list):
+                            xref = img_info[0]
+                            base_image = doc.extract_image(xref)
+                            image_bytes = base_image["image"]
+                            
+                            # Get image position on the page
+                            img_rect = page.get_image_bbox(img_info)
+                            
+                            # Insert the image back into the new page
+                            out_page.insert_image(img_rect, stream=image_bytes)
+                    except Exception as img_error:
+                        # If image extraction fails, continue with the rest of the process
+                        report("warning", f"Image extraction failed on page {page_num+1}. Some images may not be preserved.")
+                
+                # Only process borders if border_detection is True and we're not using image-based conversion
+                if border_detection and not use_image_conversion and (facts is None or facts["drawing_count"]):
+                    try:
+                        # Process borders: detect and convert to white
+                        # Get all drawings on the page
+                        paths = page.get_drawings()
+                        for path in paths:
+                            for item in path["items"]:
+                                if item[0] == "re":  # Rectangle
+                                    rect = fitz.Rect(item[1])
+                                    # Check if this rectangle is likely a border
+                                    if is_likely_border(rect, page_width, page_height):
+                                        # Draw border with text color
+                                        out_page.draw_rect(rect, color=text_rgb, fill=text_rgb)
+                    except Exception as border_error:
+                        # If border detection fails, continue with the rest of the process
+                        report("warning", f"Border detection failed on page {page_num+1}. Some borders may not be converted.")
+                
+                # Process tables if table_detection is True and we're not using image-based conversion
+                if table_detection and not use_image_conversion and (facts is None or facts["drawing_count"]):
+                    try:
+                        # Simple table detection (looking for grid-like structures)
+                        # This is a simplified approach - real table detection would be more complex
+                        paths = page.get_drawings()
+                        for path in paths:
+                            for item in path["items"]:
+                                if item[0] == "l":  # Line
+                                    # Draw lines with text color
+                                    out_page.draw_line(
+                                        fitz.Point(item[1][0], item[1][1]),
+                                        fitz.Point(item[1][2], item[1][3]),
+                                        color=text_rgb
+                                    )
+                    except Exception as table_error:
+                        # If table detection fails, continue with the rest of the process
+                        pass
             
-            # Only process borders if border_detection is True and we're not using image-based conversion
-            if border_detection and not use_image_conversion:
-                try:
-                    # Process borders: detect and convert to white
-                    # Get all drawings on the page
-                    paths = page.get_drawings()
-                    for path in paths:
-                        for item in path["items"]:
-                            if item[0] == "re":  # Rectangle
-                                rect = fitz.Rect(item[1])
-                                # Check if this rectangle is likely a border
-                                if is_likely_border(rect, page_width, page_height):
-                                    # Draw border with text color
-                                    out_page.draw_rect(rect, color=text_rgb, fill=text_rgb)
-                except Exception as border_error:
-                    # If border detection fails, continue with the rest of the process
-                    st.warning(f"Border detection failed on page {page_num+1}. Some borders may not be converted.")
+            # Save the output PDF to a bytes buffer, which keeps its size reserved
+            # until the caller closes it or drops the last reference
+            output_buffer = ReservedBuffer()
+            out_doc.save(output_buffer)
+            output_buffer.reserve(governor, output_buffer.tell())
+            output_buffer.seek(0)
             
-            # Process tables if table_detection is True and we're not using image-based conversion
-            if table_detection and not use_image_conversion:
-                try:
-                    # Simple table detection (looking for grid-like structures)
-                    # This is a simplified approach - real table detection would be more complex
-                    paths = page.get_drawings()
-                    for path in paths:
-                        for item in path["items"]:
-                            if item[0] == "l":  # Line
-                                # Draw lines with text color
-                                out_page.draw_line(
-                                    fitz.Point(item[1][0], item[1][1]),
-                                    fitz.Point(item[1][2], item[1][3]),
-                                    color=text_rgb
-                                )
-                except Exception as table_error:
-                    # If table detection fails, continue with the rest of the process
-                    pass
-        
-        # Save the output PDF to a bytes buffer
-        output_buffer = io.BytesIO()
-        out_doc.save(output_buffer)
-        output_buffer.seek(0)
-        
-        # Close the documents
-        doc.close()
-        out_doc.close()
-        
         return output_buffer
     
+    except MemoryBudgetExceeded:
+        # The caller decides whether to retry later, so don't swallow it
+        raise
+    
     except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
+        report("error", f"Error processing PDF: {str(e)}")
         return None
+    
+    finally:
+        # Close the documents on every path, not just on success
+        if out_doc is not None:
+            out_doc.close()
+        if doc is not None:
+            doc.close()
 
-def preview_pdf(pdf_data):
+def preview_pdf(pdf_data, report_callback=None):
     """Generate a preview image of the first page of a PDF."""
+    report = report_callback or streamlit_report
+    doc = None
     try:
-        # Create a temporary file to save the PDF for preview
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(pdf_data.getvalue())
-            tmp_path = tmp_file.name
-        
-        # Open the PDF and convert first page to image for preview
-        doc = fitz.open(tmp_path)
+        # Open the PDF straight from memory so there is no temporary file to clean up
+        doc = fitz.open(stream=pdf_data.getvalue(), filetype="pdf")
         if len(doc) > 0:
+            # Convert first page to image for preview
             page = doc[0]
             pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_data = pix.tobytes("png")
-            doc.close()
-            
-            # Clean up the temporary file
-            os.unlink(tmp_path)
-            
-            return img_data
+            return pix.tobytes("png")
         else:
-            doc.close()
-            os.unlink(tmp_path)
             return None
     except Exception as e:
-        st.error(f"Error generating preview: {str(e)}")
-        return None
\ No newline at end of file
+        report("error", f"Error generating preview: {str(e)}")
+        return None
+    finally:
+        if doc is not None:
+            doc.close()
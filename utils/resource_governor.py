@@ -0,0 +1,218 @@
+import io
+import os
+from collections import deque
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Global memory budget shared by every conversion running in this process
+DEFAULT_BUDGET_MB = int(os.environ.get("DARCDOCS_MEMORY_BUDGET_MB", "1024"))
+
+# How long a job may wait in the queue before it is rejected
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get("DARCDOCS_QUEUE_TIMEOUT", "300"))
+
+# Lowest resolution we degrade image-based conversions to (matches the sidebar slider)
+MIN_IMAGE_QUALITY = 1.0
+QUALITY_STEP = 0.5
+
+# Bytes held per rendered pixel while a page is being converted:
+# pixmap (3) + PIL copy (3) + grayscale (1) + contrast copy (1) + inverted (1)
+# + RGB copy (3) + PNG buffer (~3)
+IMAGE_WORKING_BYTES_PER_PIXEL = 15
+
+# Bytes per rendered pixel that stay in the output document after each page;
+# measured at 3.0, as the inserted pages are stored at raw RGB size
+IMAGE_OUTPUT_BYTES_PER_PIXEL = 3
+
+# Copies of the output held at the peak: the output document and the buffer it is saved to
+OUTPUT_COPIES = 2
+
+# Growth of the output document per page in text mode (measured around 45 KB)
+TEXT_BYTES_PER_PAGE = 64 * 1024
+
+# Input bytes, parsed document, output document and output buffer
+INPUT_COPIES = 4
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a job cannot be admitted within the queue timeout."""
+
+
+@dataclass
+class AdmissionDecision:
+    """Outcome of planning a job against the memory budget."""
+    estimated_bytes: int
+    image_quality: float
+    requested_quality: float
+    queued: bool = False
+    waited_seconds: float = 0.0
+    reason: str = ""
+
+    @property
+    def degraded(self):
+        return self.image_quality < self.requested_quality
+
+
+def estimate_job_memory(page_sizes, input_size, use_image_conversion=False, image_quality=2.0):
+    """Estimate the peak memory (in bytes) needed to convert pages of the given (width, height) sizes."""
+    estimate = input_size * INPUT_COPIES
+
+    scale = image_quality * image_quality
+    peak_page = 0
+    output_pixels = 0
+    for width, height in page_sizes:
+        pixels = width * height * scale
+        peak_page = max(peak_page, pixels)
+        output_pixels += pixels
+
+    # Pages are rendered one at a time; text mode also renders a page when text extraction fails
+    estimate += peak_page * IMAGE_WORKING_BYTES_PER_PIXEL
+
+    if use_image_conversion:
+        # Every rendered page stays in the output, which is copied again when it is saved
+        estimate += output_pixels * IMAGE_OUTPUT_BYTES_PER_PIXEL * OUTPUT_COPIES
+    else:
+        estimate += len(page_sizes) * TEXT_BYTES_PER_PAGE * OUTPUT_COPIES
+
+    return int(estimate)
+
+
+class MemoryGovernor:
+    """Admit conversion jobs against a global memory budget."""
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_MB * MB, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self.in_use = 0
+        self.active_jobs = 0
+        self._condition = threading.Condition()
+        # Jobs waiting for admission, oldest first
+        self._queue = deque()
+
+    def plan(self, page_sizes, input_size, use_image_conversion=False, image_quality=2.0):
+        """Pick the best settings for a job given the memory currently available."""
+        def estimate(quality):
+            return estimate_job_memory(page_sizes, input_size, use_image_conversion, quality)
+
+        with self._condition:
+            available = self.budget_bytes - self.in_use
+
+        requested = estimate(image_quality)
+        decision = AdmissionDecision(requested, image_quality, image_quality)
+        if requested <= available:
+            return decision
+
+        if not use_image_conversion:
+            decision.queued = True
+            decision.reason = (f"Estimated {requested / MB:.0f} MB but only {available / MB:.0f} MB "
+                               f"of the {self.budget_bytes / MB:.0f} MB budget is free; waiting for other conversions.")
+            decision.reason += self._oversize_note(requested)
+            return decision
+
+        # Step the resolution down until the job fits what is free right now
+        qualities = []
+        quality = image_quality - QUALITY_STEP
+        while quality >= MIN_IMAGE_QUALITY:
+            qualities.append(quality)
+            quality -= QUALITY_STEP
+
+        for quality in qualities:
+            cost = estimate(quality)
+            if cost <= available:
+                decision.estimated_bytes = cost
+                decision.image_quality = quality
+                decision.reason = (f"Image quality reduced from {image_quality} to {quality}: estimated "
+                                   f"{requested / MB:.0f} MB but only {available / MB:.0f} MB is free.")
+                return decision
+
+        # Nothing fits right now, so queue at the best quality that fits the whole budget
+        decision.queued = True
+        for quality in [image_quality] + qualities:
+            cost = estimate(quality)
+            decision.estimated_bytes = cost
+            decision.image_quality = quality
+            if cost <= self.budget_bytes:
+                break
+
+        decision.reason = f"Estimated {requested / MB:.0f} MB but only {available / MB:.0f} MB is free; waiting for other conversions."
+        if decision.degraded:
+            decision.reason += f" Image quality reduced from {image_quality} to {decision.image_quality}."
+        decision.reason += self._oversize_note(decision.estimated_bytes)
+        return decision
+
+    def _oversize_note(self, estimated_bytes):
+        if estimated_bytes <= self.budget_bytes:
+            return ""
+        return " The job is larger than the whole budget, so it will run on its own."
+
+    def reserve(self, nbytes):
+        """Account for memory that outlives a job, such as its result; returns the function that frees it."""
+        with self._condition:
+            self.in_use += nbytes
+
+        def release():
+            with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+
+        return release
+
+    @contextmanager
+    def admit(self, decision):
+        """Reserve memory for a planned job, waiting in the queue if necessary."""
+        # A job larger than the whole budget can only run when nothing else is
+        cost = min(decision.estimated_bytes, self.budget_bytes)
+        start = time.monotonic()
+
+        with self._condition:
+            # Jobs are admitted in arrival order, so smaller jobs arriving later
+            # cannot keep slipping past a large one that is waiting for memory
+            ticket = object()
+            self._queue.append(ticket)
+            fits = lambda: self._queue[0] is ticket and (
+                self.active_jobs == 0 or self.in_use + cost <= self.budget_bytes)
+            admitted = self._condition.wait_for(fits, timeout=self.queue_timeout)
+            self._queue.remove(ticket)
+            # Let the next job in the queue check whether it fits now
+            self._condition.notify_all()
+            if not admitted:
+                raise MemoryBudgetExceeded(
+                    f"Conversion needs about {decision.estimated_bytes / MB:.0f} MB and the "
+                    f"{self.budget_bytes / MB:.0f} MB memory budget stayed full for {self.queue_timeout:g}s."
+                )
+            self.in_use += cost
+            self.active_jobs += 1
+
+        decision.waited_seconds = time.monotonic() - start
+        try:
+            yield decision
+        finally:
+            with self._condition:
+                self.in_use -= cost
+                self.active_jobs -= 1
+                self._condition.notify_all()
+
+
+class ReservedBuffer(io.BytesIO):
+    """In-memory result that keeps its memory reserved until it is closed or garbage collected."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._releases = []
+
+    def reserve(self, memory_governor, nbytes):
+        """Hold nbytes of the governor's budget for as long as this buffer is alive."""
+        self._releases.append(weakref.finalize(self, memory_governor.reserve(nbytes)))
+
+    def close(self):
+        super().close()
+        for release in self._releases:
+            release()
+
+
+# Shared governor for the whole process
+governor = MemoryGovernor()
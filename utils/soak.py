@@ -0,0 +1,302 @@
+import argparse
+import gc
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import fitz  # PyMuPDF
+from PIL import Image
+
+# Options to cycle through, mirroring the combinations the sidebar can produce
+OPTION_SETS = [
+    {},
+    {"bg_color": "#1E1E1E", "text_color": "#03DAC5", "enhance_contrast": True},
+    {"preserve_images": False, "border_detection": False, "table_detection": False},
+    {"use_image_conversion": True, "image_quality": 1.0},
+    {"use_image_conversion": True, "image_quality": 2.0, "enhance_contrast": True},
+]
+
+
+# Conversions that are expected to fail, run every tenth iteration in turn
+FAILURE_CASES = ["truncated", "corrupt", "page_error", "page_error_image", "budget", "preview"]
+
+
+class InjectedFailure(Exception):
+    """Raised from the progress callback to make a conversion fail part-way through."""
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory upload with a name, like Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def _image_bytes(color, size=(120, 80)):
+    with Image.new("RGB", size, color) as img, io.BytesIO() as buffer:
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def generate_corpus():
+    """Build a small set of PDFs covering text, images, borders, tables and blank pages."""
+    corpus = {}
+    doc = fitz.open()
+    try:
+        # Text with a page border and a simple table
+        for page_num in range(3):
+            page = doc.new_page()
+            page.draw_rect(fitz.Rect(20, 20, 575, 822), color=(0, 0, 0), fill=(0, 0, 0))
+            page.draw_rect(fitz.Rect(25, 25, 570, 817), color=(1, 1, 1), fill=(1, 1, 1))
+            for line in range(30):
+                page.insert_text((72, 72 + line * 20), f"Page {page_num + 1}, line {line + 1}: the quick brown fox", fontsize=11)
+            for row in range(5):
+                page.draw_line(fitz.Point(72, 700 + row * 20), fitz.Point(520, 700 + row * 20))
+        corpus["text.pdf"] = doc.tobytes()
+    finally:
+        doc.close()
+
+    doc = fitz.open()
+    try:
+        # Embedded images alongside text
+        for color in ("red", "green", "blue"):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"A {color} image", fontsize=14)
+            page.insert_image(fitz.Rect(72, 100, 312, 260), stream=_image_bytes(color))
+        corpus["images.pdf"] = doc.tobytes()
+    finally:
+        doc.close()
+
+    doc = fitz.open()
+    try:
+        # Blank pages and an odd page size
+        doc.new_page()
+        doc.new_page(width=300, height=200)
+        corpus["blank.pdf"] = doc.tobytes()
+    finally:
+        doc.close()
+
+    return corpus
+
+
+def _fail_on_second_page():
+    """Progress callback that raises once the first page has been converted."""
+    calls = []
+
+    def progress(fraction):
+        calls.append(fraction)
+        if len(calls) == 2:
+            raise InjectedFailure("injected failure on page 2")
+
+    return progress
+
+
+def _ignore_report(level, message):
+    # The failures are expected, so keep them out of the soak output
+    pass
+
+
+def run_failure_case(case, corpus):
+    """Run one conversion that must fail cleanly; return what went wrong instead, or None."""
+    from .pdf_processor import convert_pdf_to_dark_mode, preview_pdf
+    from .resource_governor import governor, AdmissionDecision, MemoryBudgetExceeded
+
+    text_pdf = corpus["text.pdf"]
+    truncated = text_pdf[:len(text_pdf) // 2]
+    corrupt = b"%PDF-1.7\n" + os.urandom(2048)
+
+    if case == "preview":
+        if preview_pdf(NamedBytesIO(corrupt, "corrupt.pdf"), report_callback=_ignore_report) is not None:
+            return "preview_pdf returned an image for a corrupt PDF"
+        return None
+
+    if case == "budget":
+        # Hold the whole of a tiny budget so the job cannot be admitted
+        saved = governor.budget_bytes, governor.queue_timeout
+        blocker = governor.admit(AdmissionDecision(1, 1.0, 1.0))
+        blocker.__enter__()
+        try:
+            governor.budget_bytes, governor.queue_timeout = 1, 0
+            result = convert_pdf_to_dark_mode(NamedBytesIO(text_pdf, "text.pdf"), report_callback=_ignore_report)
+        except MemoryBudgetExceeded:
+            return None
+        finally:
+            governor.budget_bytes, governor.queue_timeout = saved
+            blocker.__exit__(None, None, None)
+        if result is not None:
+            result.close()
+        return "A job that could not be admitted did not raise MemoryBudgetExceeded"
+
+    if case in ("page_error", "page_error_image"):
+        options = {"use_image_conversion": True, "image_quality": 1.0} if case == "page_error_image" else {}
+        result = convert_pdf_to_dark_mode(NamedBytesIO(text_pdf, "text.pdf"), progress_callback=_fail_on_second_page(),
+                                          report_callback=_ignore_report, **options)
+    else:
+        data = truncated if case == "truncated" else corrupt
+        result = convert_pdf_to_dark_mode(NamedBytesIO(data, f"{case}.pdf"), report_callback=_ignore_report)
+
+    if result is not None:
+        result.close()
+        return f"The {case} conversion returned a PDF instead of failing"
+    return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def open_handles():
+    """Number of open file descriptors, or None if it cannot be read."""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def temp_files(directory):
+    """Names in the run's private temporary directory, to catch leaked temp files."""
+    try:
+        return set(os.listdir(directory))
+    except OSError:
+        return set()
+
+
+def measure():
+    # Collect garbage and drop MuPDF's cache so only real leaks show up as growth
+    gc.collect()
+    fitz.TOOLS.store_shrink(100)
+    return current_rss(), open_handles()
+
+
+def _batch_options(options):
+    """process_batch has no defaults for the sidebar options, so fill them in."""
+    batch_options = {
+        "bg_color": "#000000",
+        "text_color": "#FFFFFF",
+        "preserve_images": True,
+        "enhance_contrast": False,
+        "border_detection": True,
+        "table_detection": True
+    }
+    batch_options.update(options)
+    return batch_options
+
+
+def run_soak(iterations=2000, warmup=50, max_rss_growth_mb=64, max_handle_growth=5, report_every=250):
+    """
+    Convert the corpus repeatedly and return a list of failures (empty if the run was clean).
+
+    Every tenth iteration runs one of FAILURE_CASES instead, so the error paths
+    are checked for leaks as well as the successful ones.
+    """
+    # Imported here so the index directory can be redirected before the modules load
+    from .pdf_processor import convert_pdf_to_dark_mode, preview_pdf
+    from .batch_processor import process_batch
+    from .document_index import get_document_index
+    from .resource_governor import governor
+
+    corpus = generate_corpus()
+    names = sorted(corpus)
+    unexpected = []
+
+    def run_once(i):
+        name = names[i % len(names)]
+        options = OPTION_SETS[(i // len(names)) % len(OPTION_SETS)]
+
+        if i % 10 == 4:
+            problem = run_failure_case(FAILURE_CASES[(i // 10) % len(FAILURE_CASES)], corpus)
+            if problem and problem not in unexpected:
+                unexpected.append(problem)
+            return
+
+        if i % 10 == 9:
+            uploads = [NamedBytesIO(corpus[n], n) for n in names]
+            result = process_batch(uploads, **_batch_options(options))
+        else:
+            get_document_index(corpus[name])
+            result = convert_pdf_to_dark_mode(NamedBytesIO(corpus[name], name), **options)
+            if result is None:
+                raise RuntimeError(f"Conversion of {name} failed with options {options}")
+            if i % 5 == 0:
+                preview_pdf(result)
+        result.close()
+
+    # Give the run its own temporary directory, so anything in it afterwards was
+    # left behind by the conversions and not by some other process
+    saved_tempdir = tempfile.tempdir
+    private_tmp = tempfile.mkdtemp(prefix="darcdocs-soak-")
+    tempfile.tempdir = private_tmp
+    try:
+        for i in range(warmup):
+            run_once(i)
+
+        baseline_rss, baseline_handles = measure()
+        baseline_reserved = governor.in_use
+        start = time.monotonic()
+        failures = []
+        rss_growth = 0.0
+        handle_growth = 0
+
+        for i in range(warmup, warmup + iterations):
+            run_once(i)
+
+            done = i - warmup + 1
+            if done % report_every == 0 or done == iterations:
+                rss, handles = measure()
+                rss_growth = (rss - baseline_rss) / (1024 * 1024) if rss and baseline_rss else 0.0
+                handle_growth = handles - baseline_handles if handles is not None and baseline_handles is not None else 0
+                rate = done / (time.monotonic() - start)
+                print(f"{done}/{iterations} conversions ({rate:.1f}/s): RSS {rss_growth:+.1f} MB, "
+                      f"open handles {handle_growth:+d}")
+
+        if rss_growth > max_rss_growth_mb:
+            failures.append(f"RSS grew by {rss_growth:.1f} MB (limit {max_rss_growth_mb} MB)")
+        if handle_growth > max_handle_growth:
+            failures.append(f"Open handles grew by {handle_growth} (limit {max_handle_growth})")
+        leaked = temp_files(private_tmp)
+        if leaked:
+            failures.append(f"{len(leaked)} temporary files left behind, e.g. {sorted(leaked)[0]}")
+        if governor.in_use != baseline_reserved or governor.active_jobs:
+            failures.append(f"{governor.in_use - baseline_reserved} bytes of the memory budget were never "
+                            f"released ({governor.active_jobs} jobs still admitted)")
+        failures.extend(unexpected)
+
+        return failures
+    finally:
+        tempfile.tempdir = saved_tempdir
+        shutil.rmtree(private_tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run thousands of conversions in one process and check for leaks")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64)
+    parser.add_argument("--max-handle-growth", type=int, default=5)
+    args = parser.parse_args()
+
+    # Keep the soak run's pre-scans out of the real index
+    with tempfile.TemporaryDirectory() as index_dir:
+        os.environ.setdefault("DARCDOCS_INDEX_DIR", index_dir)
+        failures = run_soak(args.iterations, args.warmup, args.max_rss_growth_mb, args.max_handle_growth)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("PASS: no resource growth beyond the thresholds")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
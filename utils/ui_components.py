@@ -1,4 +1,5 @@
 import streamlit as st
+from .document_index import get_document_index, estimate_cost
 
 def setup_page_config():
     """Set up the Streamlit page configuration."""
@@ -284,12 +285,37 @@ def show_app_header():
     </div>
     """, unsafe_allow_html=True)
 
-def show_file_details(uploaded_file):
-    """Display details about the uploaded file."""
+# Scans are small, but every distinct upload adds one for the life of the server
+@st.cache_data(show_spinner="Scanning PDF...", max_entries=256)
+def scan_uploaded_file(file_id, name, size, _uploaded_file):
+    """Pre-scan an upload once; the key leaves out the file so reruns don't re-hash it."""
+    try:
+        return get_document_index(_uploaded_file.getvalue())
+    except Exception:
+        # Cache the failure too, so a broken PDF isn't rescanned on every rerun
+        return None
+
+def show_file_details(uploaded_file, options=None):
+    """Display details about the uploaded file and an estimate of its conversion cost."""
     file_details = {
         "Filename": uploaded_file.name,
         "File size": f"{uploaded_file.size / 1024:.2f} KB"
     }
+    
+    # Pre-scan the document (cached per upload) to show what the conversion will involve
+    entry = scan_uploaded_file(getattr(uploaded_file, "file_id", None), uploaded_file.name,
+                               uploaded_file.size, uploaded_file)
+    if entry is not None:
+        cost = estimate_cost(entry, **(options or {}))
+        file_details["Pages"] = f"{cost['pages']} ({cost['text_pages']} with extractable text)"
+        file_details["Content"] = (f"{cost['spans']} text spans, {cost['images']} images, "
+                                   f"{cost['drawings']} drawings, {cost['fonts']} fonts")
+        file_details["Estimated memory"] = f"{cost['memory_mb']:.1f} MB"
+        if cost["text_pages"] < cost["pages"] and not (options or {}).get("use_image_conversion"):
+            file_details["Note"] = "Some pages have no extractable text; consider Preserve Layout (Image-Based)."
+    else:
+        file_details["Pages"] = "Could not scan this PDF"
+    
     st.markdown('<div class="glass-container">', unsafe_allow_html=True)
     st.markdown("### File Details")
     for key, value in file_details.items():